@@ -13,13 +13,13 @@ import cv2
 import random
 import preprocess_data
 import numpy as np
-import matplotlib.pyplot as plt
 from torchvision import datasets, transforms
 from torch.utils.data import Dataset, DataLoader
 from torchvision.transforms import ToTensor
 from tqdm import tqdm
 from pathlib import Path
 from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
 
 
 
@@ -143,37 +143,45 @@ class PotholeDataset(Dataset):
     def __len__(self):
         return self.length
 
+    def load_crop(self, image_path, bbox):
+        crop_img = preprocess_data.crop_image(
+            image_path = image_path, 
+            bbox = bbox, 
+            padding = self.padding, 
+            padding_size = self.padding_size, 
+            use_shift = self.use_shift, 
+            use_bbox = self.use_bbox, 
+            imsave = self.imsave
+        )
+
+        crop_img = cv2.resize(crop_img, (self.input_size, self.input_size))
+        if (crop_img.shape[-1]==3):
+            crop_img = cv2.cvtColor(crop_img, cv2.COLOR_BGR2RGB)
+        return Image.fromarray(crop_img)
+
     # Crop image data
     def get_crop(self):
         img_list=[]
         img_path=[]
         img_bbox=[]
         label_list=[]
-        for v in tqdm(self.data_set, desc='Image Cropping... '):
-            if v.class_id not in self.use_class:
-                continue
-            # image_path = self.data_path / v.data_set / v.label / v.image_path
-            image_path = v.data_set / v.image_path
-            crop_img = preprocess_data.crop_image(
-                image_path = image_path, 
-                bbox = v.bbox, 
-                padding = self.padding, 
-                padding_size = self.padding_size, 
-                use_shift = self.use_shift, 
-                use_bbox = self.use_bbox, 
-                imsave = self.imsave
-            )
-
-            crop_img = cv2.resize(crop_img, (self.input_size, self.input_size))
-            if (crop_img.shape[-1]==3):
-                crop_img = cv2.cvtColor(crop_img, cv2.COLOR_BGR2RGB)
-            pil_image=Image.fromarray(crop_img)
+        data_set = [v for v in self.data_set if v.class_id in self.use_class]
+        # cv2 releases the GIL while reading/decoding, so threads overlap the disk I/O
+        with ThreadPoolExecutor() as executor:
+            future_list = []
+            for v in data_set:
+                # image_path = self.data_path / v.data_set / v.label / v.image_path
+                image_path = v.data_set / v.image_path
+                future_list.append(executor.submit(self.load_crop, image_path, v.bbox))
+            for v, future in zip(data_set, tqdm(future_list, desc='Image Cropping... ')):
+                image_path = v.data_set / v.image_path
+                pil_image = future.result()
 
-            # for i in range(self.upsample[v.class_id]):
-            img_list.append(pil_image)
-            label_list.append(v.label)
-            img_path.append(str(image_path))
-            img_bbox.append(torch.tensor(v.bbox))
+                # for i in range(self.upsample[v.class_id]):
+                img_list.append(pil_image)
+                label_list.append(v.label)
+                img_path.append(str(image_path))
+                img_bbox.append(torch.tensor(v.bbox))
 
         self.classes = list(np.sort(np.unique(label_list)))
         self.class_to_idx = {string : i for i, string in enumerate(self.classes)}
@@ -203,6 +211,60 @@ class PotholeDataset(Dataset):
         return (image, img_path, img_bbox, clss)
 
 
+# Dataset Class for prediction 
+class CropDataset(Dataset):
+    # Returns resized uint8 BGR crops (HWC); color conversion and normalization run on the GPU
+    def __init__(self, data_list, args):
+        super().__init__()
+        self.data_list = data_list
+
+        self.input_size = args.input_size
+        self.padding = args.padding 
+        self.padding_size = args.padding_size 
+        self.use_shift = args.use_shift 
+        self.use_bbox = args.use_bbox 
+        self.imsave = args.imsave
+
+    def __len__(self):
+        return len(self.data_list)
+
+    @staticmethod
+    def get_target(label):
+        # File 이름에 label이 있는지 확인
+        spltnm = str(label).split('_')
+        target = int(spltnm[0][1]) if spltnm[0][0] == 't' else -1
+
+        # label이 따로 있는 경우 아래 4가지 label로 지정
+        if target == -1:
+            if label == 'amb_neg':
+                target = 0 # amb_neg
+            elif label == 'amb_pos':
+                target = 1 # amb_pos
+            elif label == 'negative':
+                target = 2 # neg
+            elif label == 'positive':
+                target = 3 # pos
+            else:
+                target =-1
+        return target
+
+    def __getitem__(self, idx):
+        data = self.data_list[idx]
+        image_path = data[0] / data.image_path
+        crop_img = preprocess_data.crop_image(
+            image_path = image_path, 
+            bbox = data.bbox, 
+            padding = self.padding, 
+            padding_size = self.padding_size, 
+            use_shift = self.use_shift, 
+            use_bbox = self.use_bbox, 
+            imsave = self.imsave
+        )
+
+        crop_img = cv2.resize(crop_img, (self.input_size, self.input_size))
+        return (torch.from_numpy(crop_img), self.get_target(data.label), str(image_path), data.label)
+
+
 if __name__ == "__main__":
     data_root = Path('/home/daree/data/pothole_data/raw')
     sets = preprocess_data.split_data(data_root, 0.1, 0.1, ['positive', 'negative'], file_write=False)
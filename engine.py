@@ -7,11 +7,9 @@
 
 
 import math
+import contextlib
 import torch
-import preprocess_data
 import shutil
-import cv2
-import matplotlib.pyplot as plt
 import numpy as np
 import utils
 
@@ -20,8 +18,6 @@ from timm.data import Mixup
 from timm.utils import accuracy, ModelEma
 
 from tqdm import tqdm
-from torchvision import transforms
-from PIL import Image
 from timm.models import create_model
 from timm.data.constants import IMAGENET_DEFAULT_MEAN, IMAGENET_DEFAULT_STD, IMAGENET_INCEPTION_MEAN, IMAGENET_INCEPTION_STD
 from pathlib import Path
@@ -32,119 +28,163 @@ def train_one_epoch(model: torch.nn.Module, criterion: torch.nn.Module,
                     device: torch.device, epoch: int, loss_scaler, max_norm: float = 0,
                     model_ema: Optional[ModelEma] = None, mixup_fn: Optional[Mixup] = None, log_writer=None,
                     wandb_logger=None, start_steps=None, lr_schedule_values=None, wd_schedule_values=None,
-                    num_training_steps_per_epoch=None, update_freq=None, use_amp=False, use_softlabel=False):
+                    num_training_steps_per_epoch=None, update_freq=None, use_amp=False, amp_dtype='fp16',
+                    use_softlabel=False, channels_last=False):
     model.train(True)
     metric_logger = utils.MetricLogger(delimiter="  ")
     metric_logger.add_meter('lr', utils.SmoothedValue(window_size=1, fmt='{value:.6f}'))
     metric_logger.add_meter('min_lr', utils.SmoothedValue(window_size=1, fmt='{value:.6f}'))
     header = 'Epoch: [{}]'.format(epoch)
     print_freq = 10
-    optimizer.zero_grad()
-
-    # for data_iter_step, (samples, targets) in enumerate(metric_logger.log_every(data_loader, print_freq, header)):
-    for data_iter_step, batch in enumerate(metric_logger.log_every(data_loader, print_freq, header)):
-        samples = batch[0]
-        targets = batch[-1]
-
+    optimizer.zero_grad(set_to_none=True)
+    # look through the torch.compile wrapper, if any; its state_dict keys carry an '_orig_mod.' prefix
+    # that ModelEma.update can not match, so the EMA is updated from the wrapped module
+    model_without_compile = getattr(model, '_orig_mod', model)
+    is_ddp = isinstance(model_without_compile, torch.nn.parallel.DistributedDataParallel)
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+    autocast_dtype = torch.bfloat16 if amp_dtype == 'bf16' else torch.float16
+    # bf16 keeps the fp32 exponent range, so it skips the GradScaler and its per-step sync
+    use_scaler = use_amp and autocast_dtype == torch.float16
+    lr_scales = [group["lr_scale"] for group in optimizer.param_groups] if lr_schedule_values is not None else None
+    loss_buf = []
+    acc_buf = []
+    grad_norm_buf = []
+
+    # samples/targets arrive already on the device, copied on a side stream one batch ahead
+    prefetcher = utils.CUDAPrefetcher(data_loader, device, memory_format=memory_format)
+    for data_iter_step, (samples, targets) in enumerate(metric_logger.log_every(prefetcher, print_freq, header)):
         step = data_iter_step // update_freq
         if step >= num_training_steps_per_epoch:
             continue
         it = start_steps + step  # global training iteration
         # Update LR & WD for the first acc
-        if lr_schedule_values is not None or wd_schedule_values is not None and data_iter_step % update_freq == 0:
+        if data_iter_step % update_freq == 0 and (lr_schedule_values is not None or wd_schedule_values is not None):
+            lr_now = lr_schedule_values[it] if lr_schedule_values is not None else None
+            wd_now = wd_schedule_values[it] if wd_schedule_values is not None else None
             for i, param_group in enumerate(optimizer.param_groups):
-                if lr_schedule_values is not None:
-                    param_group["lr"] = lr_schedule_values[it] * param_group["lr_scale"]
-                if wd_schedule_values is not None and param_group["weight_decay"] > 0:
-                    param_group["weight_decay"] = wd_schedule_values[it]
-
-        samples = samples.to(device, non_blocking=True)
-        targets = targets.to(device, non_blocking=True)
+                if lr_now is not None:
+                    param_group["lr"] = lr_now * lr_scales[i]
+                if wd_now is not None and param_group["weight_decay"] > 0:
+                    param_group["weight_decay"] = wd_now
 
         if mixup_fn is not None:
             samples, targets = mixup_fn(samples, targets)
 
-        if use_amp:
-            with torch.cuda.amp.autocast():
-                output = model(samples)
-                loss = criterion(output, targets)
-        else: # full precision
-            output, outvect = model(samples, onlyfc=False)
-            loss = criterion(output, targets)
-  
-        loss_value = loss.item()
-
-        if not math.isfinite(loss_value): # this could trigger if using AMP
-            print("Loss is {}, stopping training".format(loss_value))
-            assert math.isfinite(loss_value)
+        # skip the gradient all-reduce on micro-batches that do not step the optimizer
+        if is_ddp and (data_iter_step + 1) % update_freq != 0:
+            sync_ctx = model.no_sync()
+        else:
+            sync_ctx = contextlib.nullcontext()
 
-        if use_amp:
-            # this attribute is added by timm on one optimizer (adahessian)
-            is_second_order = hasattr(optimizer, 'is_second_order') and optimizer.is_second_order
-            loss /= update_freq
-            grad_norm = loss_scaler(loss, optimizer, clip_grad=max_norm,
-                                    parameters=model.parameters(), create_graph=is_second_order,
-                                    update_grad=(data_iter_step + 1) % update_freq == 0)
-            if (data_iter_step + 1) % update_freq == 0:
-                optimizer.zero_grad()
-                if model_ema is not None:
-                    model_ema.update(model)
-        else: # full precision
-            loss /= update_freq
-            loss.backward()
-            if (data_iter_step + 1) % update_freq == 0:
-                optimizer.step()
-                optimizer.zero_grad()
-                if model_ema is not None:
-                    model_ema.update(model)
-
-        torch.cuda.synchronize()
+        with sync_ctx:
+            if use_amp:
+                with torch.cuda.amp.autocast(dtype=autocast_dtype):
+                    output = model(samples)
+                    loss = criterion(output, targets)
+            else: # full precision
+                output, outvect = model(samples, onlyfc=False)
+                loss = criterion(output, targets)
+            loss_buf.append(loss.detach())
+
+            if use_scaler:
+                # this attribute is added by timm on one optimizer (adahessian)
+                is_second_order = hasattr(optimizer, 'is_second_order') and optimizer.is_second_order
+                loss = loss / update_freq
+                grad_norm = loss_scaler(loss, optimizer, clip_grad=max_norm,
+                                        parameters=model.parameters(), create_graph=is_second_order,
+                                        update_grad=(data_iter_step + 1) % update_freq == 0)
+                if (data_iter_step + 1) % update_freq == 0:
+                    optimizer.zero_grad(set_to_none=True)
+                    if model_ema is not None:
+                        model_ema.update(model_without_compile)
+            else: # full precision or bf16 autocast
+                loss = loss / update_freq
+                loss.backward()
+                grad_norm = None
+                if (data_iter_step + 1) % update_freq == 0:
+                    if use_amp:
+                        if max_norm is not None:
+                            grad_norm = torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm)
+                        else:
+                            grad_norm = utils.get_grad_norm_(model.parameters())
+                    optimizer.step()
+                    optimizer.zero_grad(set_to_none=True)
+                    if model_ema is not None:
+                        model_ema.update(model_without_compile)
+
+        # grad_norm only exists on accumulation boundaries, which need not be print iterations
+        if grad_norm is not None:
+            grad_norm_buf.append(grad_norm.detach())
 
         if mixup_fn is None:
             if use_softlabel:
-                targets = torch.tensor([0 if i==2 or i==0 else 1 for i in targets]).to(device)
-            class_acc = (output.max(-1)[-1] == targets).float().mean()*100
-        else:
-            class_acc = None
-        metric_logger.update(loss=loss_value)
-        metric_logger.update(class_acc=class_acc)
-        min_lr = 10.
-        max_lr = 0.
-        for group in optimizer.param_groups:
-            min_lr = min(min_lr, group["lr"])
-            max_lr = max(max_lr, group["lr"])
-
-        metric_logger.update(lr=max_lr)
-        metric_logger.update(min_lr=min_lr)
-        weight_decay_value = None
-        for group in optimizer.param_groups:
-            if group["weight_decay"] > 0:
-                weight_decay_value = group["weight_decay"]
-        metric_logger.update(weight_decay=weight_decay_value)
-        if use_amp:
-            metric_logger.update(grad_norm=grad_norm)
+                targets = ((targets != 0) & (targets != 2)).long() # 0, 2 -> 0 / 1, 3 -> 1
+            acc_buf.append((output.max(-1)[-1] == targets).float().mean()*100)
+
+        # keep loss/acc on the GPU and only sync/log when the logger is about to print
+        if data_iter_step % print_freq == 0 or data_iter_step + 1 == len(data_loader):
+            loss_value = torch.stack(loss_buf).mean().item()
+            if not math.isfinite(loss_value): # this could trigger if using AMP
+                print("Loss is {}, stopping training".format(loss_value))
+                assert math.isfinite(loss_value)
+            metric_logger.meters['loss'].update(loss_value, n=len(loss_buf))
+            if acc_buf:
+                class_acc = torch.stack(acc_buf).mean().item()
+                metric_logger.meters['class_acc'].update(class_acc, n=len(acc_buf))
+            else:
+                class_acc = None
+            if grad_norm_buf:
+                grad_norm = torch.stack(grad_norm_buf).mean().item()
+                metric_logger.meters['grad_norm'].update(grad_norm, n=len(grad_norm_buf))
+            else:
+                grad_norm = None
+            loss_buf.clear()
+            acc_buf.clear()
+            grad_norm_buf.clear()
+
+            min_lr = 10.
+            max_lr = 0.
+            weight_decay_value = None
+            for group in optimizer.param_groups:
+                min_lr = min(min_lr, group["lr"])
+                max_lr = max(max_lr, group["lr"])
+                if group["weight_decay"] > 0:
+                    weight_decay_value = group["weight_decay"]
+
+            metric_logger.update(lr=max_lr)
+            metric_logger.update(min_lr=min_lr)
+            metric_logger.update(weight_decay=weight_decay_value)
+
+            if log_writer is not None:
+                log_writer.update(loss=loss_value, head="loss")
+                log_writer.update(class_acc=class_acc, head="loss")
+                log_writer.update(lr=max_lr, head="opt")
+                log_writer.update(min_lr=min_lr, head="opt")
+                log_writer.update(weight_decay=weight_decay_value, head="opt")
+                log_writer.update(grad_norm=grad_norm, head="opt")
+
+            if wandb_logger:
+                wandb_logger._wandb.log({
+                    'Rank-0 Batch Wise/train_loss': loss_value,
+                    'Rank-0 Batch Wise/train_max_lr': max_lr,
+                    'Rank-0 Batch Wise/train_min_lr': min_lr
+                }, commit=False)
+                if class_acc:
+                    wandb_logger._wandb.log({'Rank-0 Batch Wise/train_class_acc': class_acc}, commit=False)
+                if grad_norm is not None:
+                    wandb_logger._wandb.log({'Rank-0 Batch Wise/train_grad_norm': grad_norm}, commit=False)
+                wandb_logger._wandb.log({'Rank-0 Batch Wise/global_train_step': it})
 
         if log_writer is not None:
-            log_writer.update(loss=loss_value, head="loss")
-            log_writer.update(class_acc=class_acc, head="loss")
-            log_writer.update(lr=max_lr, head="opt")
-            log_writer.update(min_lr=min_lr, head="opt")
-            log_writer.update(weight_decay=weight_decay_value, head="opt")
-            if use_amp:
-                log_writer.update(grad_norm=grad_norm, head="opt")
             log_writer.set_step()
 
-        if wandb_logger:
-            wandb_logger._wandb.log({
-                'Rank-0 Batch Wise/train_loss': loss_value,
-                'Rank-0 Batch Wise/train_max_lr': max_lr,
-                'Rank-0 Batch Wise/train_min_lr': min_lr
-            }, commit=False)
-            if class_acc:
-                wandb_logger._wandb.log({'Rank-0 Batch Wise/train_class_acc': class_acc}, commit=False)
-            if use_amp:
-                wandb_logger._wandb.log({'Rank-0 Batch Wise/train_grad_norm': grad_norm}, commit=False)
-            wandb_logger._wandb.log({'Rank-0 Batch Wise/global_train_step': it})
+    # the last print iteration may be skipped (step >= num_training_steps_per_epoch), so drain what is left
+    if loss_buf:
+        metric_logger.meters['loss'].update(torch.stack(loss_buf).mean().item(), n=len(loss_buf))
+    if acc_buf:
+        metric_logger.meters['class_acc'].update(torch.stack(acc_buf).mean().item(), n=len(acc_buf))
+    if grad_norm_buf:
+        metric_logger.meters['grad_norm'].update(torch.stack(grad_norm_buf).mean().item(), n=len(grad_norm_buf))
 
     # gather the stats from all processes
     metric_logger.synchronize_between_processes()
@@ -152,22 +192,38 @@ def train_one_epoch(model: torch.nn.Module, criterion: torch.nn.Module,
     return {k: meter.global_avg for k, meter in metric_logger.meters.items()}
 
 
-@torch.no_grad()
-def evaluate(data_loader, model, device, criterion=torch.nn.CrossEntropyLoss(), use_amp=False, use_softlabel=False):
+@torch.inference_mode()
+def evaluate(data_loader, model, device, criterion=torch.nn.CrossEntropyLoss(), use_amp=False, amp_dtype='fp16',
+             use_softlabel=False, channels_last=False):
     metric_logger = utils.MetricLogger(delimiter="  ")
     header = 'Test:'
 
     # switch to evaluation mode
     model.eval()
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+
+    # per-class top-1/top-2 hit counts, accumulated on the device and read back once
+    class_names = {}
+    for class_name, class_id in data_loader.dataset.class_to_idx.items():
+        if use_softlabel:
+            class_id = 0 if class_id==2 or class_id==0 else 1
+            class_name = 'negative' if class_name == 'amb_neg' else class_name
+            class_name = 'positive' if class_name == 'amb_pos' else class_name
+        class_names[class_id] = class_name
+    num_classes = 2 if use_softlabel else len(data_loader.dataset.class_to_idx)
+    class_total = torch.zeros(num_classes, device=device)
+    class_correct1 = torch.zeros(num_classes, device=device)
+    class_correct5 = torch.zeros(num_classes, device=device)
+
     for batch in metric_logger.log_every(data_loader, 10, header):
-        images = batch[0].to(device, non_blocking=True)
+        images = batch[0].to(device, non_blocking=True, memory_format=memory_format)
         target = batch[-1].to(device, non_blocking=True)
         if use_softlabel:
-            target = torch.tensor([0 if i==2 or i==0 else 1 for i in target]).to(device)
+            target = ((target != 0) & (target != 2)).long() # 0, 2 -> 0 / 1, 3 -> 1
 
         # compute output
         if use_amp:
-            with torch.cuda.amp.autocast():
+            with torch.cuda.amp.autocast(dtype=torch.bfloat16 if amp_dtype == 'bf16' else torch.float16):
                 output = model(images)
                 loss = criterion(output, target)
         else:
@@ -181,25 +237,19 @@ def evaluate(data_loader, model, device, criterion=torch.nn.CrossEntropyLoss(),
         metric_logger.meters['acc1'].update(acc1.item(), n=batch_size)
         metric_logger.meters['acc5'].update(acc5.item(), n=batch_size)
 
-        for class_name, class_id in data_loader.dataset.class_to_idx.items():
-            if use_softlabel:
-                class_id = 0 if class_id==2 or class_id==0 else 1 
-                class_name = 'negative' if class_name == 'amb_neg' else class_name
-                class_name = 'positive' if class_name == 'amb_pos' else class_name
-
-            mask = (target == class_id)
-            target_class = torch.masked_select(target, mask)
-            data_size = target_class.shape[0]
-            if data_size > 0:
-                mask = mask.unsqueeze(1).expand_as(output)
-                output_class = torch.masked_select(output, mask)
-                if use_softlabel:
-                    output_class = output_class.view(-1, 2)
-                else:
-                    output_class = output_class.view(-1, len(data_loader.dataset.class_to_idx))
-                acc1_class, acc5_class = accuracy(output_class, target_class, topk=(1, 2)) # top5는 의미 없어 2로 변경
-                metric_logger.meters[f'acc1_{class_name}'].update(acc1_class.item(), n=data_size)
-                metric_logger.meters[f'acc5_{class_name}'].update(acc5_class.item(), n=data_size)
+        topk = output.topk(min(2, output.shape[1]), dim=1).indices # top5는 의미 없어 2로 변경
+        correct = topk == target.unsqueeze(1)
+        class_total.scatter_add_(0, target, torch.ones_like(target, dtype=class_total.dtype))
+        class_correct1.scatter_add_(0, target, correct[:, 0].to(class_total.dtype))
+        class_correct5.scatter_add_(0, target, correct.any(dim=1).to(class_total.dtype))
+
+    class_total, class_correct1, class_correct5 = torch.stack(
+        (class_total, class_correct1, class_correct5)).tolist()
+    for class_id, class_name in class_names.items():
+        data_size = int(class_total[class_id])
+        if data_size > 0:
+            metric_logger.meters[f'acc1_{class_name}'].update(class_correct1[class_id] * 100. / data_size, n=data_size)
+            metric_logger.meters[f'acc5_{class_name}'].update(class_correct5[class_id] * 100. / data_size, n=data_size)
 
     # gather the stats from all processes
     metric_logger.synchronize_between_processes()
@@ -208,16 +258,14 @@ def evaluate(data_loader, model, device, criterion=torch.nn.CrossEntropyLoss(),
     return {k: meter.global_avg for k, meter in metric_logger.meters.items()}
 
 
-@torch.no_grad()
+@torch.inference_mode()
 def prediction(args, device):
-    from datasets import PotholeDataset, get_split_data
-    from sklearn.metrics import precision_score , recall_score , confusion_matrix, ConfusionMatrixDisplay
+    from datasets import CropDataset, get_split_data
     import random
 
     imagenet_default_mean_and_std = args.imagenet_default_mean_and_std
     mean = IMAGENET_INCEPTION_MEAN if not imagenet_default_mean_and_std else IMAGENET_DEFAULT_MEAN
     std = IMAGENET_INCEPTION_STD if not imagenet_default_mean_and_std else IMAGENET_DEFAULT_STD
-    totorch = transforms.ToTensor()
 
     # 모델 생성 train한 모델과 같은 모델을 생성해야 함.
     model = create_model(
@@ -235,6 +283,10 @@ def prediction(args, device):
         args=args, model=model, model_without_ddp=model,
         optimizer=None, loss_scaler=None, model_ema=None)
     model.eval()
+    memory_format = torch.channels_last if args.channels_last else torch.contiguous_format
+    model = model.to(memory_format=memory_format)
+    if args.compile:
+        model = utils.compile_model(model)
 
     # Data laod     
     data_list = []
@@ -248,168 +300,167 @@ def prediction(args, device):
     data_list = sets['test'] if len(sets['test']) > 0 else sets['val']
 
     random.shuffle(data_list)  # Data list shuffle
-    tonorm = transforms.Normalize(mean, std)  # Transform 생성
-    for data in tqdm(data_list, desc='Image Cropping... '):
-        crop_img = preprocess_data.crop_image(
-            image_path = data[0] / data.image_path, 
-            bbox = data.bbox, 
-            padding = args.padding, 
-            padding_size = args.padding_size, 
-            use_shift = args.use_shift, 
-            use_bbox = args.use_bbox, 
-            imsave = args.imsave
-        )
-
-        # File 이름에 label이 있는지 확인
-        spltnm = str(data[1]).split('_')
-        target = int(spltnm[0][1]) if spltnm[0][0] == 't' else -1
-
-        # label이 따로 있는 경우 아래 4가지 label로 지정
-        if target == -1:
-            if data[1] == 'amb_neg':
-                target = 0 # amb_neg
-            elif data[1] == 'amb_pos':
-                target = 1 # amb_pos
-            elif data[1] == 'negative':
-                target = 2 # neg
-            elif data[1] == 'positive':
-                target = 3 # pos
-            else:
-                target =-1
-
-        crop_img = cv2.resize(crop_img, (args.input_size, args.input_size))
-        crop_img = cv2.cvtColor(crop_img, cv2.COLOR_BGR2RGB)
-        pil_image=Image.fromarray(crop_img)
-        input_tensor = totorch(pil_image).to(device)
-        input_tensor = input_tensor.unsqueeze(dim=0)
-        input_tensor = tonorm(input_tensor)
-        
+    dataset = CropDataset(data_list, args)
+    data_loader = torch.utils.data.DataLoader(
+        dataset, 
+        batch_size=args.batch_size,
+        num_workers=args.num_workers,
+        pin_memory=args.pin_mem,
+        shuffle=False,
+        drop_last=False
+    )
+    # (x / 255 - mean) / std == (x - 255 * mean) / (255 * std), broadcast over NCHW
+    mean = torch.tensor(mean, device=device).view(1, -1, 1, 1) * 255
+    std = torch.tensor(std, device=device).view(1, -1, 1, 1) * 255
+    # persistent model input buffer, filled and normalized in place for every batch
+    input_buf = torch.empty(args.batch_size, 3, args.input_size, args.input_size, device=device,
+                            memory_format=memory_format)
+    for crops, targets, paths, labels in tqdm(data_loader, desc='Prediction... '):
+        # uint8 BGR NHWC crops -> normalized RGB NCHW float on the device
+        images = input_buf[:crops.shape[0]]
+        images.copy_(crops.to(device, non_blocking=True).permute(0, 3, 1, 2).flip(1))
+        images.sub_(mean).div_(std)
+
         # model output 
-        output_tensor = model(input_tensor) 
-        pred, conf = int(torch.argmax(output_tensor).detach().cpu().numpy()), float((torch.max(output_tensor)).detach().cpu().numpy())
-        result.append((pred, conf, target, data[0] / data.image_path, data.label))
+        output = model(images)
+        conf, pred = output.max(dim=1)
+        result.extend(zip(pred.cpu().tolist(), conf.cpu().tolist(), targets.tolist(), map(Path, paths), labels))
         
     ##################################### save result image & anno #####################################
     if args.pred_save:
         import os
-        os.makedirs(Path(args.pred_save_path) /'amb_neg' / 'images', exist_ok=True)
-        os.makedirs(Path(args.pred_save_path) /'amb_neg' / 'annotations', exist_ok=True)
-        os.makedirs(Path(args.pred_save_path) /'amb_pos' / 'images', exist_ok=True)
-        os.makedirs(Path(args.pred_save_path) /'amb_pos' / 'annotations', exist_ok=True)
-        os.makedirs(Path(args.pred_save_path) /'negative' / 'images', exist_ok=True)
-        os.makedirs(Path(args.pred_save_path) /'negative' / 'annotations', exist_ok=True)
-        os.makedirs(Path(args.pred_save_path) /'positive' / 'images', exist_ok=True)
-        os.makedirs(Path(args.pred_save_path) /'positive' / 'annotations', exist_ok=True)
-
-        amb_neg = [x[-1] for x in result if x[0]==0]
-        amb_pos = [x[-1] for x in result if x[0]==1]
-        neg = [x[-1] for x in result if x[0]==2]
-        pos = [x[-1] for x in result if x[0]==3]
-        
-        for n in tqdm(amb_neg, desc='Negative images copying... '):
-            shutil.copy(n, Path(args.pred_save_path) /'amb_neg' / 'images')
-            shutil.copy(str(n)[:-3]+'txt', Path(args.pred_save_path) / 'amb_neg' / 'annotations')
-        for p in tqdm(amb_pos, desc='Positive images copying... '):
-            shutil.copy(p, Path(args.pred_save_path) / 'amb_pos' / 'images')
-            shutil.copy(str(p)[:-3]+'txt', Path(args.pred_save_path) / 'amb_pos' / 'annotations')
-        for n in tqdm(neg, desc='Negative images copying... '):
-            shutil.copy(n, Path(args.pred_save_path) /'negative' / 'images')
-            shutil.copy(str(n)[:-3]+'txt', Path(args.pred_save_path) / 'negative' / 'annotations')
-        for p in tqdm(pos, desc='Positive images copying... '):
-            shutil.copy(p, Path(args.pred_save_path) / 'positive' / 'images')
-            shutil.copy(str(p)[:-3]+'txt', Path(args.pred_save_path) / 'positive' / 'annotations')
+        from concurrent.futures import ThreadPoolExecutor
+        pred_dirs = ['amb_neg', 'amb_pos', 'negative', 'positive']
+        for pred_dir in pred_dirs:
+            os.makedirs(Path(args.pred_save_path) / pred_dir / 'images', exist_ok=True)
+            os.makedirs(Path(args.pred_save_path) / pred_dir / 'annotations', exist_ok=True)
+
+        # (src, dst) pairs for every predicted image and its annotation
+        jobs = []
+        for x in result:
+            if 0 <= x[0] < len(pred_dirs):
+                jobs.append((x[3], Path(args.pred_save_path) / pred_dirs[x[0]] / 'images'))
+                jobs.append((str(x[3])[:-3]+'txt', Path(args.pred_save_path) / pred_dirs[x[0]] / 'annotations'))
+        # result has one entry per bbox, so images with several bboxes would be copied (and raced) repeatedly
+        jobs = list(dict.fromkeys(jobs))
+
+        # shutil.copy releases the GIL on read/write, so the copies overlap across threads
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            list(tqdm(executor.map(lambda job: shutil.copy(*job), jobs), total=len(jobs), desc='Result images copying... '))
     ##################################### save result image & anno #####################################
 
     ##################################### save evalutations #####################################
     if args.pred_eval:
-        if np.sum(np.array(result)[...,2]) < 0:
-            conf_TN = [x[1] for x in result if (x[0]==0)]
-            conf_TP = [x[1] for x in result if (x[0]==1)]
-            conf_FN = []
-            conf_FP = []
-
-            # index set    
-            itn = [i for i in range(len(result)) if (result[i][0]==0)]
-            itp = [i for i in range(len(result)) if (result[i][0]==1)]
-
-            # histogram P-N 
-            plt.hist((conf_TN, conf_TP), label=('Negative', 'Positive'),histtype='bar', bins=50)
-            plt.xlabel('Confidence')
-            plt.ylabel('Conunt')
-            plt.legend(loc='upper left')
-            plt.savefig(args.pred_eval_name+'hist_PN.png')
-            plt.close()
+        result_npz_path = 'image/'+args.pred_eval_name+'raw.npz'
+        np.savez(result_npz_path,
+                 preds=np.array([x[0] for x in result], dtype=np.int64),
+                 confs=np.array([x[1] for x in result], dtype=np.float32),
+                 targets=np.array([x[2] for x in result], dtype=np.int64))
+        plot_prediction_eval(result_npz_path, args)
+    ##################################### save evalutations #####################################
 
-        else:
-            y_pred = [i[0] for i in result]
-            y_target = [i[2] for i in result]
-            pos_val = 3
-
-            # 4class to 2class 변경
-            if args.use_softlabel:
-                y_pred = [0 if i==2 or i==0 else 1 for i in y_pred]
-                y_target = [0 if i==2 or i==0 else 1 for i in y_target]
-                pos_val = 1
-
-            # precision recall 계산
-            precision = precision_score(y_target, y_pred, average= "macro")
-            recall = recall_score(y_target, y_pred, average= "macro")
-            cm = confusion_matrix(y_target, y_pred)
-            cm_display = ConfusionMatrixDisplay(cm).plot()
-            plt.title('Precision: {0:.4f}, Recall: {1:.4f}'.format(precision, recall))
-            plt.savefig('image/'+args.pred_eval_name+'cm.png')
-            plt.close()
-            print(cm)
-            print('정밀도: {0:.4f}, 재현율: {1:.4f}'.format(precision, recall))
-
-            # collect data 
-            conf_TN = [x[1] for p, t, x in zip(y_pred, y_target,result) if p==t and p!=pos_val] 
-            conf_TP = [x[1] for p, t, x in zip(y_pred, y_target,result) if p==t and p==pos_val] 
-            conf_FN = [x[1] for p, t, x in zip(y_pred, y_target,result) if p!=t and p!=pos_val] 
-            conf_FP = [x[1] for p, t, x in zip(y_pred, y_target,result) if p!=t and p==pos_val] 
-            
-            # get index 
-            itn = [i for i in range(len(result)) if (y_pred[i]==y_target[i] and y_pred[i]!=pos_val)]
-            itp = [i for i in range(len(result)) if (y_pred[i]==y_target[i] and y_pred[i]==pos_val)]
-            ifn = [i for i in range(len(result)) if (y_pred[i]!=y_target[i] and y_pred[i]!=pos_val)]
-            ifp = [i for i in range(len(result)) if (y_pred[i]!=y_target[i] and y_pred[i]==pos_val)]
-            
-            # histogram T-F 
-            plt.hist(((conf_TN+conf_TP),(conf_FN+conf_FP)), label=('True', 'False'),histtype='bar', bins=50)
-            plt.xlabel('Confidence')
-            plt.ylabel('Conunt')
-            plt.legend(loc='best')
-            plt.savefig('image/'+args.pred_eval_name+'hist_tf.png')
-            plt.close()
-
-            # histogram TN TP FN FP
-            plt.hist((conf_TN,conf_TP,conf_FN,conf_FP), label=('TN', 'TP','FN','FP'),histtype='bar', bins=30)
-            plt.xlabel('Confidence')
-            plt.ylabel('Conunt')
-            plt.legend(loc='best')
-            plt.savefig('image/'+args.pred_eval_name+'hist_4.png')
-            plt.close()
-            
-        # scatter graph
-        if len(conf_TN):
-            plt.scatter(conf_TN, itn, alpha=0.4, color='tab:blue', label='TN', s=20)
-        if len(conf_TP):
-            plt.scatter(conf_TP, itp, alpha=0.4, color='tab:orange', label='TP', s=20)
-        if len(conf_FN):
-            plt.scatter(conf_FN, ifn, alpha=0.4, color='tab:green', marker='x', label='FN', s=20)
-        if len(conf_FP):
-            plt.scatter(conf_FP, ifp, alpha=0.4, color='tab:red', marker='x', label='FT', s=20)
-        plt.legend(loc='best')
-        plt.xlabel('Confidence')
-        plt.ylabel('Image Index')
-        plt.savefig('image/'+args.pred_eval_name+'scater.png')
-        plt.close()
 
-        # histogram 
-        plt.hist(((conf_TN+conf_TP+conf_FN+conf_FP)), histtype='bar', bins=50)
-        plt.xlabel('Confidence')
-        plt.ylabel('Conunt')
-        plt.savefig('image/'+args.pred_eval_name+'hist.png')
-        plt.close()
+def plot_prediction_eval(result_npz_path, args):
+    """
+    Draw the prediction evaluation graphs from the raw results saved by prediction()
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from sklearn.metrics import precision_score , recall_score , confusion_matrix, ConfusionMatrixDisplay
 
-    ##################################### save evalutations #####################################
+    result = np.load(result_npz_path)
+    preds = result['preds']
+    confs = result['confs']
+    targets = result['targets']
+
+    if np.sum(targets) < 0:
+        tn_mask = preds == 0
+        tp_mask = preds == 1
+        conf_TN = confs[tn_mask]
+        conf_TP = confs[tp_mask]
+        conf_FN = confs[:0]
+        conf_FP = confs[:0]
+
+        # index set    
+        itn = np.flatnonzero(tn_mask)
+        itp = np.flatnonzero(tp_mask)
+        ifn = itn[:0]
+        ifp = itn[:0]
+
+        # histogram P-N 
+        hists = [((conf_TN, conf_TP), ('Negative', 'Positive'), 50)]
+
+    else:
+        y_pred = preds
+        y_target = targets
+        pos_val = 3
+
+        # 4class to 2class 변경
+        if args.use_softlabel:
+            y_pred = np.where((y_pred == 2) | (y_pred == 0), 0, 1)
+            y_target = np.where((y_target == 2) | (y_target == 0), 0, 1)
+            pos_val = 1
+
+        # precision recall 계산
+        precision = precision_score(y_target, y_pred, average= "macro")
+        recall = recall_score(y_target, y_pred, average= "macro")
+        cm = confusion_matrix(y_target, y_pred)
+        cm_display = ConfusionMatrixDisplay(cm).plot()
+        plt.title('Precision: {0:.4f}, Recall: {1:.4f}'.format(precision, recall))
+        plt.savefig('image/'+args.pred_eval_name+'cm.png')
+        plt.close()
+        print(cm)
+        print('정밀도: {0:.4f}, 재현율: {1:.4f}'.format(precision, recall))
+
+        # collect data 
+        true_mask = y_pred == y_target
+        pos_mask = y_pred == pos_val
+        tn_mask = true_mask & ~pos_mask
+        tp_mask = true_mask & pos_mask
+        fn_mask = ~true_mask & ~pos_mask
+        fp_mask = ~true_mask & pos_mask
+        conf_TN = confs[tn_mask]
+        conf_TP = confs[tp_mask]
+        conf_FN = confs[fn_mask]
+        conf_FP = confs[fp_mask]
+        
+        # get index 
+        itn = np.flatnonzero(tn_mask)
+        itp = np.flatnonzero(tp_mask)
+        ifn = np.flatnonzero(fn_mask)
+        ifp = np.flatnonzero(fp_mask)
+        
+        # histogram T-F, histogram TN TP FN FP
+        hists = [((confs[true_mask], confs[~true_mask]), ('True', 'False'), 50),
+                 ((conf_TN, conf_TP, conf_FN, conf_FP), ('TN', 'TP', 'FN', 'FP'), 30)]
+
+    # histogram 
+    hists.append((np.concatenate((conf_TN, conf_TP, conf_FN, conf_FP)), None, 50))
+
+    # all histograms share one figure
+    fig, axes = plt.subplots(1, len(hists), figsize=(6.4 * len(hists), 4.8), squeeze=False)
+    for ax, (data, label, bins) in zip(axes[0], hists):
+        ax.hist(data, label=label, histtype='bar', bins=bins)
+        ax.set_xlabel('Confidence')
+        ax.set_ylabel('Conunt')
+        if label is not None:
+            ax.legend(loc='best')
+    fig.tight_layout()
+    fig.savefig('image/'+args.pred_eval_name+'hist.png')
+    plt.close(fig)
+
+    # scatter graph
+    if len(conf_TN):
+        plt.scatter(conf_TN, itn, alpha=0.4, color='tab:blue', label='TN', s=20)
+    if len(conf_TP):
+        plt.scatter(conf_TP, itp, alpha=0.4, color='tab:orange', label='TP', s=20)
+    if len(conf_FN):
+        plt.scatter(conf_FN, ifn, alpha=0.4, color='tab:green', marker='x', label='FN', s=20)
+    if len(conf_FP):
+        plt.scatter(conf_FP, ifp, alpha=0.4, color='tab:red', marker='x', label='FT', s=20)
+    plt.legend(loc='best')
+    plt.xlabel('Confidence')
+    plt.ylabel('Image Index')
+    plt.savefig('image/'+args.pred_eval_name+'scater.png')
+    plt.close()
@@ -206,6 +206,12 @@ def get_args_parser():
 
     parser.add_argument('--use_amp', type=str2bool, default=False, 
                         help="Use PyTorch's AMP (Automatic Mixed Precision) or not")
+    parser.add_argument('--amp_dtype', type=str, default='fp16', choices=['fp16', 'bf16'],
+                        help="Autocast dtype for AMP; bf16 needs no loss scaling (Ampere or newer)")
+    parser.add_argument('--channels_last', type=str2bool, default=True,
+                        help="Use channels_last memory format for the model and its inputs")
+    parser.add_argument('--compile', type=str2bool, default=False,
+                        help="Wrap the model with torch.compile (requires PyTorch 2.0+)")
 
     # Weights and Biases arguments
     parser.add_argument('--enable_wandb', type=str2bool, default=False,
@@ -422,6 +428,8 @@ def main(args):
                 del checkpoint_model[k]
         utils.load_state_dict(model, checkpoint_model, prefix=args.model_prefix)
     model.to(device)
+    if args.channels_last:
+        model = model.to(memory_format=torch.channels_last)
 
     model_ema = None
     if args.model_ema:
@@ -462,26 +470,29 @@ def main(args):
         model = torch.nn.parallel.DistributedDataParallel(model, device_ids=[args.gpu], find_unused_parameters=False)
         model_without_ddp = model.module
 
+    if args.compile:
+        model = utils.compile_model(model)
+
     optimizer = create_optimizer(
         args, model_without_ddp, skip_list=None,
         get_num_layer=assigner.get_layer_id if assigner is not None else None, 
         get_layer_scale=assigner.get_scale if assigner is not None else None)
 
-    loss_scaler = NativeScaler() # if args.use_amp is False, this won't be used
+    loss_scaler = NativeScaler() # if args.use_amp is False or amp_dtype is bf16, this won't be used
     
     if args.cosine_scheduler:
         print("Use Cosine LR scheduler")
         lr_schedule_values = utils.cosine_scheduler(
             args.lr, args.min_lr, args.epochs, num_training_steps_per_epoch,
             warmup_epochs=args.warmup_epochs, warmup_steps=args.warmup_steps,
-        )
+        ).tolist() # plain floats, so per-step indexing in train_one_epoch is a list lookup
     else:
         lr_schedule_values = None
 
     if args.weight_decay_end is None:
         args.weight_decay_end = args.weight_decay
     wd_schedule_values = utils.cosine_scheduler(
-        args.weight_decay, args.weight_decay_end, args.epochs, num_training_steps_per_epoch)
+        args.weight_decay, args.weight_decay_end, args.epochs, num_training_steps_per_epoch).tolist()
     if len(wd_schedule_values):
         print("Max WD = %.7f, Min WD = %.7f" % (max(wd_schedule_values), min(wd_schedule_values)))
     else:
@@ -498,7 +509,7 @@ def main(args):
 
     if args.eval:
         print(f"Eval only mode")
-        test_stats = evaluate(data_loader_val, model, device, criterion=criterion, use_amp=args.use_amp, use_softlabel=args.use_softlabel)
+        test_stats = evaluate(data_loader_val, model, device, criterion=criterion, use_amp=args.use_amp, amp_dtype=args.amp_dtype, use_softlabel=args.use_softlabel, channels_last=args.channels_last)
         print(f"Accuracy of the network on {len(dataset_val)} test images: {test_stats['acc1']:.5f}%")
         with open('results/eval.txt', 'a', encoding='utf-8') as af:
             af.write(f'{args.resume}\t{args.eval_data_path}')
@@ -530,7 +541,8 @@ def main(args):
             log_writer=log_writer, wandb_logger=wandb_logger, start_steps=epoch * num_training_steps_per_epoch,
             lr_schedule_values=lr_schedule_values, wd_schedule_values=wd_schedule_values,
             num_training_steps_per_epoch=num_training_steps_per_epoch, update_freq=args.update_freq,
-            use_amp=args.use_amp, use_softlabel=args.use_softlabel
+            use_amp=args.use_amp, amp_dtype=args.amp_dtype, use_softlabel=args.use_softlabel,
+            channels_last=args.channels_last
         )
         if args.output_dir and args.save_ckpt:
             if (epoch + 1) % args.save_ckpt_freq == 0 or epoch + 1 == args.epochs:
@@ -538,7 +550,7 @@ def main(args):
                     args=args, model=model, model_without_ddp=model_without_ddp, optimizer=optimizer,
                     loss_scaler=loss_scaler, epoch=epoch, model_ema=model_ema)
         if data_loader_val is not None:
-            test_stats = evaluate(data_loader_val, model, device, criterion=criterion, use_amp=args.use_amp, use_softlabel=args.use_softlabel)
+            test_stats = evaluate(data_loader_val, model, device, criterion=criterion, use_amp=args.use_amp, amp_dtype=args.amp_dtype, use_softlabel=args.use_softlabel, channels_last=args.channels_last)
             print(f"Accuracy of the model on the {len(dataset_val)} test images: {test_stats['acc1']:.1f}%")
             if max_accuracy < test_stats["acc1"]:
                 max_accuracy = test_stats["acc1"]
@@ -560,7 +572,7 @@ def main(args):
 
             # repeat testing routines for EMA, if ema eval is turned on
             if args.model_ema and args.model_ema_eval:
-                test_stats_ema = evaluate(data_loader_val, model_ema.ema, device, use_amp=args.use_amp, use_softlabel=args.use_softlabel)
+                test_stats_ema = evaluate(data_loader_val, model_ema.ema, device, use_amp=args.use_amp, amp_dtype=args.amp_dtype, use_softlabel=args.use_softlabel, channels_last=args.channels_last)
                 print(f"Accuracy of the model EMA on {len(dataset_val)} test images: {test_stats_ema['acc1']:.1f}%")
                 if max_accuracy_ema < test_stats_ema["acc1"]:
                     max_accuracy_ema = test_stats_ema["acc1"]
@@ -1,3 +1,4 @@
+import io
 import os
 import cv2
 import pickle
@@ -12,6 +13,14 @@ from tqdm import tqdm
 from pathlib import Path
 from collections import defaultdict, namedtuple
 from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+
+try:
+    # libjpeg-turbo (SIMD) JPEG codec, used instead of cv2 when installed
+    from turbojpeg import TurboJPEG, TJSAMP_420
+    turbo_jpeg = TurboJPEG()
+except (ImportError, RuntimeError, OSError):
+    turbo_jpeg = None
 
 RawData = namedtuple('RawData', 'data_set, label, image_path, idx, class_id, bbox')
 
@@ -33,9 +42,34 @@ def xywh2xyxy(bbox, width, height):
     y2 = int(np.clip(y + h / 2, 0, 1) * height)
     return x1, y1, x2, y2
 
+def is_jpeg(path):
+    return str(path).lower().endswith(('.jpg', '.jpeg'))
+
+def read_image(image_path):
+    # cv2.imread rotates by the EXIF orientation tag but TurboJPEG.decode does not, so rotated
+    # JPEGs go through cv2 to keep the bbox crops identical whether or not turbojpeg is installed.
+    # Files that only carry a .jpg name (e.g. PNG data) or an unparsable header also fall back to cv2
+    if turbo_jpeg is not None and is_jpeg(image_path):
+        try:
+            with open(image_path, 'rb') as rf:
+                data = rf.read()
+            if Image.open(io.BytesIO(data)).getexif().get(0x0112, 1) == 1:  # only parses the header
+                return turbo_jpeg.decode(data)  # BGR, same as cv2.imread
+        except Exception:
+            pass
+    return cv2.imread(str(image_path))
+
+def write_image(output_path, image):
+    if turbo_jpeg is not None and is_jpeg(output_path):
+        with open(output_path, 'wb') as wf:
+            # cv2.imwrite defaults: quality 95, 4:2:0 chroma (TurboJPEG.encode would pick 4:2:2)
+            wf.write(turbo_jpeg.encode(image, quality=95, jpeg_subsample=TJSAMP_420))
+        return
+    cv2.imwrite(str(output_path), image)
+
 def crop_image(image_path, bbox, padding, padding_size, use_shift, use_bbox, output_path=None, imsave=True):
     try:
-        image = cv2.imread(str(image_path))
+        image = read_image(image_path)
         height, width, _ = image.shape
         x1, y1, x2, y2 = xywh2xyxy(bbox, width, height)
         if use_bbox:
@@ -89,7 +123,7 @@ def crop_image(image_path, bbox, padding, padding_size, use_shift, use_bbox, out
                 y2 = np.clip(y2 + pad_y, 0, height)
         image = image[y1:y2, x1:x2]
         if imsave:
-            cv2.imwrite(str(output_path), image)
+            write_image(output_path, image)
             return True
         else:
             return image
@@ -220,7 +254,8 @@ def split_data(data_root, test_ratio, val_ratio, label_list=None, file_write=Fal
         # split_info = defaultdict(lambda: random.choices(split_population, split_weights)[0], split_info)
 
     data_list = make_list(data_root, label_list, split_info)
-    if file_write:
+    # nothing new to write when the split was just loaded from disk
+    if file_write and not split_info_path.exists():
         print(f'make {split_info_path}')
         with split_info_path.open('wb') as wf:
             split_info = dict(split_info)
@@ -169,6 +169,46 @@ class MetricLogger(object):
             header, total_time_str, total_time / denom))
 
 
+class CUDAPrefetcher(object):
+    """Copy the next batch's samples/targets to the device on a side stream
+    while the current batch is being processed. The DataLoader should use
+    pin_memory=True, otherwise the host-to-device copies are synchronous.
+    """
+
+    def __init__(self, data_loader, device, memory_format=torch.contiguous_format):
+        self.data_loader = data_loader
+        self.device = torch.device(device)
+        self.memory_format = memory_format
+        self.stream = torch.cuda.Stream(device=self.device) if self.device.type == 'cuda' else None
+
+    def __len__(self):
+        return len(self.data_loader)
+
+    def preload(self, loader_iter):
+        try:
+            batch = next(loader_iter)
+        except StopIteration:
+            return None
+        with torch.cuda.stream(self.stream):
+            samples = batch[0].to(self.device, non_blocking=True, memory_format=self.memory_format)
+            targets = batch[-1].to(self.device, non_blocking=True)
+        return samples, targets
+
+    def __iter__(self):
+        loader_iter = iter(self.data_loader)
+        next_batch = self.preload(loader_iter)
+        while next_batch is not None:
+            samples, targets = next_batch
+            if self.stream is not None:
+                current_stream = torch.cuda.current_stream(self.device)
+                current_stream.wait_stream(self.stream)
+                # allocated on the side stream, consumed on the current one
+                samples.record_stream(current_stream)
+                targets.record_stream(current_stream)
+            next_batch = self.preload(loader_iter)
+            yield samples, targets
+
+
 class TensorboardLogger(object):
     def __init__(self, log_dir):
         self.writer = SummaryWriter(log_dir=log_dir)
@@ -413,6 +453,13 @@ class NativeScalerWithGradNormCount:
         self._scaler.load_state_dict(state_dict)
 
 
+def compile_model(model):
+    if not hasattr(torch, 'compile'):
+        print("torch.compile is not available (PyTorch < 2.0), running the model eagerly")
+        return model
+    return torch.compile(model)
+
+
 def get_grad_norm_(parameters, norm_type: float = 2.0) -> torch.Tensor:
     if isinstance(parameters, torch.Tensor):
         parameters = [parameters]